@@ -1,11 +1,143 @@
- 
-
 import multiprocessing as mp
 import asyncio
 import uuid
 import traceback
-from typing import Callable, Dict, Any
-from multiprocessing.connection import Connection
+import pickle
+import concurrent.futures
+import logging
+import sys
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from multiprocessing.reduction import ForkingPickler
+from typing import Callable, Deque, Dict, Any, List, Optional, Sequence, Set, Tuple, Union
+
+# Out-of-band buffers smaller than this are returned inline; shared memory setup isn't worth it
+_SHM_MIN_BYTES = 64 * 1024
+
+_PackedResult = Tuple[bytes, Optional[str], list]
+
+# Library default stays silent unless the application configures logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# Functions registered through AsyncerMp.register(), installed once per worker by _init_worker
+_worker_registry: Dict[str, Callable] = {}
+_worker_use_uvloop = False
+# Set when worker_initializer raised; tasks on that worker report it instead of running
+_worker_init_error: Optional[str] = None
+
+# The forkserver preload list is process-global; only the first AsyncerMp sets it
+_forkserver_preload_set = False
+
+
+def _fast_loop_module():
+    """
+    Returns uvloop (winloop on Windows) if it is installed, else None.
+    """
+    try:
+        if sys.platform == "win32":
+            import winloop as loop_module
+        else:
+            import uvloop as loop_module
+    except ImportError:
+        return None
+    return loop_module
+
+
+def run(main, use_uvloop: bool = True) -> Any:
+    """
+    Drop-in for asyncio.run() that runs the coroutine on uvloop (winloop on Windows) when available.
+    Falls back to the stock asyncio loop if neither is installed or use_uvloop is False.
+    """
+    loop_module = _fast_loop_module() if use_uvloop else None
+    if loop_module is None:
+        return asyncio.run(main)
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=loop_module.new_event_loop) as runner:
+            return runner.run(main)
+    loop_module.install()
+    return asyncio.run(main)
+
+
+def _init_worker(registry: Dict[str, Callable], worker_initializer: Optional[Callable], initargs: tuple,
+                 use_uvloop: bool = False) -> None:
+    """
+    Pool initializer: unpickles the registered functions once per worker process,
+    then runs the user's worker_initializer.
+    A failing worker_initializer is recorded rather than raised: raising would kill the worker and
+    break the pool, hiding the real error behind a generic crash and restarting the pool per task.
+    """
+    global _worker_use_uvloop, _worker_init_error
+    _worker_use_uvloop = use_uvloop
+    _worker_registry.update(registry)
+    if worker_initializer is not None:
+        try:
+            worker_initializer(*initargs)
+        except Exception as e:
+            _worker_init_error = f"Worker initializer failed: {e}. Traceback: {traceback.format_exc()}"
+
+
+def _pack_result(result: Dict[str, Any]) -> _PackedResult:
+    """
+    Pickles the result with protocol 5. Large out-of-band buffers (NumPy arrays, PickleBuffer objects; plain
+    bytes/bytearray stay in-band) are written into a SharedMemory block so only the pickle header goes back
+    over the pool pipe.
+    """
+    raws = []
+    header = pickle.dumps(result, protocol=5, buffer_callback=lambda b: raws.append(b.raw()))
+    total = sum(r.nbytes for r in raws)
+    if total < _SHM_MIN_BYTES:
+        # bytearray, not bytes: rebuilt arrays must stay writable, same as on the shared memory path
+        return header, None, [bytearray(r) for r in raws]
+
+    shm = shared_memory.SharedMemory(create=True, size=total)
+    offsets = []
+    pos = 0
+    for r in raws:
+        shm.buf[pos:pos + r.nbytes] = r
+        offsets.append((pos, r.nbytes))
+        pos += r.nbytes
+    shm.close()
+    return header, shm.name, offsets
+
+
+def _unpack_result(packed: _PackedResult) -> Dict[str, Any]:
+    """
+    Rebuilds a result packed by _pack_result and frees its SharedMemory block.
+    Buffers are copied out once so the block can be unlinked right away.
+    """
+    header, shm_name, payload = packed
+    if shm_name is None:
+        return pickle.loads(header, buffers=payload)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffers = []
+        for offset, length in payload:
+            with shm.buf[offset:offset + length] as view:
+                buffers.append(bytearray(view))
+        return pickle.loads(header, buffers=buffers)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _top_level_runner(async_func: Union[Callable, str], task_data: Any) -> _PackedResult:
+    """
+    Runs the async task inside a pool worker and returns the packed result dict.
+    Module-level so the pool can pickle it by reference.
+    A str async_func is looked up in the worker registry instead of being unpickled per call.
+    """
+    if _worker_init_error is not None:
+        return _pack_result({"status": False, "data": None, "error": _worker_init_error})
+    try:
+        if isinstance(async_func, str):
+            async_func = _worker_registry[async_func]
+        result = run(async_func(task_data), use_uvloop=_worker_use_uvloop)
+        return _pack_result({"status": True, "data": result})
+    except Exception as e:
+        error_message = f"Worker failed: {e}. Traceback: {traceback.format_exc()}"
+        return _pack_result({"status": False, "data": None, "error": error_message})
 
 
 class AsyncerMp:
@@ -13,91 +145,170 @@ class AsyncerMp:
     A hybrid async + multiprocessing wrapper to execute heavy tasks in parallel without blocking the event loop.
     """
 
-    def __init__(self, max_processes: int = 4, logger=None):
+    def __init__(self, max_processes: int = 4, logger=None, preload_modules: Sequence[str] = (),
+                 queue_size: int = None, worker_initializer: Callable = None, initargs: tuple = (),
+                 use_uvloop: bool = False):
         """
         Args:
             max_processes (int): Max concurrent subprocesses allowed.
-            logger: Optional logger with .debug and .error methods.
+            logger: Optional logging.Logger. Defaults to the module logger (logging.getLogger("asyncermp")).
+            preload_modules: Modules the forkserver imports once so workers fork with them loaded
+                (e.g. "numpy"). The forkserver is shared by the whole process, so only the first
+                AsyncerMp instance sets its preload list; later instances' preload_modules are ignored.
+            queue_size (int): Max completion events buffered for next_batch(). Defaults to max_processes * 4.
+                Past that the oldest event is dropped (the task's Future is still resolved).
+            worker_initializer: Optional callable run once in each worker at startup, called with initargs.
+                Import heavyweight libraries (numpy, torch, ...) here so tasks don't pay for it.
+            initargs (tuple): Arguments passed to worker_initializer.
+            use_uvloop (bool): Run tasks inside workers on uvloop (winloop on Windows) when installed.
+                Use asyncermp.run() to do the same for the parent loop.
         """
         self.max_processes = max_processes
-        self.logger = logger or (lambda: None)
-        self.logger.debug = getattr(self.logger, 'debug', lambda x: None)
-        self.logger.error = getattr(self.logger, 'error', lambda x: None)
+        # forkserver forks workers from a small pre-imported server: spawn's safety without re-importing
+        # everything per worker. Falls back to spawn where forkserver isn't available (Windows).
+        if "forkserver" in mp.get_all_start_methods():
+            global _forkserver_preload_set
+            self._ctx = mp.get_context("forkserver")
+            if not _forkserver_preload_set:
+                self._ctx.set_forkserver_preload(["__main__", __name__, *preload_modules])
+                _forkserver_preload_set = True
+        else:
+            self._ctx = mp.get_context("spawn")
+        self.logger = logger or logging.getLogger(__name__)
 
-        self._task_queue: asyncio.Queue = asyncio.Queue()
-        self._futures: Dict[str, asyncio.Future] = {}
-        self._semaphore = asyncio.Semaphore(self.max_processes)
+        queue_size = queue_size or self.max_processes * 4
+        self.dropped_completions = 0  # Completion events dropped because nobody called next_batch()
 
-        self.completed_queue: asyncio.Queue = asyncio.Queue()  # Public event stream for task completions
+        self._tasks: Set[asyncio.Task] = set()  # Strong refs so in-flight _run_task coroutines aren't collected
+        self._registry: Dict[str, Callable] = {}
+        self._worker_initializer = worker_initializer
+        self._initargs = initargs
+        self._use_uvloop = use_uvloop
+        # Long-lived workers, reused across tasks instead of one process per task. Started on first use
+        # so functions registered before then are shipped to each worker only once.
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
 
-    def _worker_process(self, task_data: Any, async_func: Callable, pipe_conn: Connection) -> None:
+        # Completions accumulate here and are handed out together by next_batch(): one consumer
+        # wakeup per burst instead of one queue put/get per task
+        self._completed_batch: Deque[Tuple[str, Dict[str, Any]]] = deque(maxlen=queue_size)
+        self._batch_ready = asyncio.Event()
+
+    def register(self, name: str, async_func: Callable) -> None:
         """
-        Internal method to run the async task inside a subprocess and send back the result.
+        Register an async function under a name so submit() can refer to it by name.
+        Registered functions are pickled once per worker instead of once per task.
+
+        Args:
+            name: Key to pass as async_func to submit().
+            async_func: The async function to execute. Must be picklable (module-level function,
+                or a bound method of a picklable object).
+
+        Raises:
+            TypeError: async_func can't be pickled, so it could never be shipped to the workers.
         """
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        if self._pool is not None:
+            raise RuntimeError("register() must be called before the first task is started")
+        # Fail here rather than on the first task, where it would take the whole pool down with it
         try:
-            result = loop.run_until_complete(async_func(task_data))
-            pipe_conn.send({"status": True, "data": result})
-        except Exception as e:
-            error_message = f"Worker failed: {e}. Traceback: {traceback.format_exc()}"
-            self.logger.error(error_message)
-            pipe_conn.send({"status": False, "data": None, "error": error_message})
-        finally:
-            loop.close()
-            pipe_conn.close()
+            ForkingPickler.dumps(async_func)
+        except (pickle.PicklingError, TypeError, ValueError, AttributeError) as e:
+            raise TypeError(f"Function registered as {name!r} can't be pickled: {e}") from e
+        self._registry[name] = async_func
+
+    def _get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        Returns the worker pool, starting it on first use.
+        """
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=self._ctx,
+                initializer=_init_worker,
+                initargs=(dict(self._registry), self._worker_initializer, self._initargs, self._use_uvloop)
+            )
+        return self._pool
 
-    async def submit(self, task_data: Any, async_func: Callable, uid: str = None) -> asyncio.Future:
+    def _discard_pool(self, pool: concurrent.futures.ProcessPoolExecutor) -> None:
+        """
+        Drops a pool that is broken (dead worker) or failed to start workers, so the next task starts a fresh one.
+        """
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False)
+
+    async def submit(self, task_data: Any, async_func: Union[Callable, str], uid: str = None) -> asyncio.Future:
         """
         Submit a task to the wrapper.
 
         Args:
             task_data: Data passed to your async function.
-            async_func: The async function to execute.
+            async_func: The async function to execute, or the name it was registered under.
             uid: Optional uid to identify the task in logs or background logger.
 
         Returns:
             asyncio.Future that will contain the task result.
         """
-        task_id = str(uuid.uuid4())
+        if isinstance(async_func, str) and async_func not in self._registry:
+            raise KeyError(f"No function registered as {async_func!r}")
         future = asyncio.get_running_loop().create_future()
-        self._futures[task_id] = future
-        await self._task_queue.put((task_id, task_data, async_func, uid or task_id))
+        task = asyncio.create_task(self._run_task(future, task_data, async_func, uid or str(uuid.uuid4())))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
         return future
 
-    async def _runner(self):
+    async def _run_task(self, future: asyncio.Future, task_data: Any, async_func: Callable, uid: str):
         """
-        Background coroutine that constantly picks tasks and launches them.
+        Internal coroutine that hands each job to the worker pool and tracks its result.
         """
-        while True:
-            task_id, task_data, async_func, uid = await self._task_queue.get()
-            asyncio.create_task(self._run_task(task_id, task_data, async_func, uid))
+        pool = None
+        pool_future = None
+        try:
+            pool = self._get_pool()
+            pool_future = pool.submit(_top_level_runner, async_func, task_data)
+            # Cancelling the caller's Future drops the job if no worker picked it up yet, so cancelled
+            # tasks don't hold worker slots. A job already running finishes and its result is discarded.
+            future.add_done_callback(lambda f: f.cancelled() and pool_future.cancel())
+            packed = await asyncio.wrap_future(pool_future)
+            result = _unpack_result(packed)
+            if not result["status"]:
+                self.logger.error("Task %s failed: %s", uid, result["error"])
+        except BrokenProcessPool as e:
+            # A worker died (crash, os._exit, OOM kill); every job on that pool fails, later ones get a new pool
+            self.logger.error("Worker pool broke while running task %s: %s", uid, e)
+            self._discard_pool(pool)
+            result = {"status": False, "data": None, "error": str(e)}
+        except Exception as e:
+            self.logger.error("Exception receiving result for task %s: %s", uid, e, exc_info=True)
+            if pool is not None and pool_future is None:
+                # pool.submit() itself failed (worker start, initargs pickling): don't reuse that pool
+                self._discard_pool(pool)
+            result = {"status": False, "data": None, "error": str(e)}
+        if not future.done():
+            future.set_result(result)
+            if len(self._completed_batch) == self._completed_batch.maxlen:
+                self.dropped_completions += 1
+                # Expected when only the Futures are awaited and next_batch() is never called
+                self.logger.debug("Completion buffer full, dropped oldest event to make room for task %s", uid)
+            self._completed_batch.append((uid, result))
+            self._batch_ready.set()
 
-    async def _run_task(self, task_id: str, task_data: Any, async_func: Callable, uid: str):
+    async def next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
         """
-        Internal coroutine that wraps each subprocess job and tracks its result.
+        Wait for task completions and return every (uid, result) pair finished since the last call.
+
+        Returns:
+            List of (uid, result) tuples, oldest first. Never empty.
         """
-        async with self._semaphore:
-            parent_conn, child_conn = mp.Pipe()
-            process = mp.Process(
-                target=self._worker_process,
-                args=(task_data, async_func, child_conn)
-            )
-            process.start()
-
-            try:
-                result = await asyncio.get_event_loop().run_in_executor(None, parent_conn.recv)
-                if task_id in self._futures and not self._futures[task_id].done():
-                    self._futures[task_id].set_result(result)
-                    await self.completed_queue.put((uid, result))
-            except Exception as e:
-                self.logger.error(f"Exception receiving result for task {task_id}: {e}")
-                error_result = {"status": False, "data": None, "error": str(e)}
-                if task_id in self._futures and not self._futures[task_id].done():
-                    self._futures[task_id].set_result(error_result)
-                    await self.completed_queue.put((uid, error_result))
-            finally:
-                parent_conn.close()
-                process.join()
-                self._futures.pop(task_id, None)
+        while not self._completed_batch:
+            self._batch_ready.clear()
+            await self._batch_ready.wait()
+        batch = list(self._completed_batch)
+        self._completed_batch.clear()
+        return batch
 
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker pool. Pending tasks are still completed when wait is True.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)